@@ -14,6 +14,8 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parents[1]
 DATA_DIR = BASE_DIR / "data"
 PROCESSED_DIR = DATA_DIR / "processed"
+OPTIMIZED_DIR = DATA_DIR / "optimized"
+CACHE_DIR = DATA_DIR / "cache"  # 慢变参考数据 (成分股/行业分类) 的本地缓存
 LOG_DIR = BASE_DIR / "logs"
 
 # ===========================
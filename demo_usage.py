@@ -7,6 +7,8 @@ FreeQuantDatabase 调用演示 (列名查看版)
 import duckdb
 import pandas as pd
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # ==========================================
 # 1. 环境配置 (保持不变)
@@ -16,26 +18,46 @@ CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PATH_PROCESSED = os.path.join(CURRENT_DIR, "data", "processed")
 PATH_OPTIMIZED = os.path.join(CURRENT_DIR, "data", "optimized")
 
-pd.set_option('display.max_columns', None) # 显示所有列
-pd.set_option('display.width', 1000)
-
 print(f"📂 标准数据源: {PATH_PROCESSED}")
 print(f"🚀 极速数据源: {PATH_OPTIMIZED}\n")
 
 con = duckdb.connect()
 
+# 性能配置: 同一会话里有 8+ 个查询反复摸同一批 Parquet 文件，
+# 打开对象缓存后文件元数据 (Footer/Schema) 只解析一次
+con.execute(f"PRAGMA threads={os.cpu_count() or 4}")
+con.execute("PRAGMA memory_limit='4GB'")
+con.execute("PRAGMA enable_object_cache=true")
+
 # ==========================================
 # 2. 智能注册视图 (Auto-Routing) (保持不变)
 # ==========================================
 
-def register_smart_view(view_name, folder_name):
+# 并发注册时串行化 DDL，目录探测 (exists/listdir，真正耗时的部分) 保持并行
+_con_lock = threading.Lock()
+
+def register_smart_view(view_name, folder_name, union_by_name=False):
     opt_path = os.path.join(PATH_OPTIMIZED, folder_name)
     proc_path = os.path.join(PATH_PROCESSED, folder_name)
-    
-    if os.path.exists(opt_path) and len(os.listdir(opt_path)) > 0:
+
+    # 性能注意: 行情类数据集所有文件 Schema 一致，默认不开 union_by_name
+    # (否则 DuckDB 会逐个读取所有文件的 Footer，注册极慢)；
+    # 列集异构的数据集 (如 stock_financial) 由调用方显式传 True
+    extra = ", union_by_name=true" if union_by_name else ""
+
+    # scandir 迭代器只取第一项就能判断非空，不用像 listdir 把几千个文件名全部载入
+    def _dir_not_empty(path):
         try:
-            sql = f"CREATE OR REPLACE VIEW {view_name} AS SELECT * FROM read_parquet('{opt_path}/*.parquet', union_by_name=true)"
-            con.execute(sql)
+            with os.scandir(path) as it:
+                return next(it, None) is not None
+        except OSError:
+            return False
+
+    if _dir_not_empty(opt_path):
+        try:
+            sql = f"CREATE OR REPLACE VIEW {view_name} AS SELECT * FROM read_parquet('{opt_path}/*.parquet'{extra})"
+            with _con_lock:
+                con.execute(sql)
             print(f"  🚀 [极速模式] View [{view_name}] registered")
             return
         except Exception:
@@ -43,8 +65,9 @@ def register_smart_view(view_name, folder_name):
 
     if os.path.exists(proc_path):
         try:
-            sql = f"CREATE OR REPLACE VIEW {view_name} AS SELECT * FROM read_parquet('{proc_path}/*/*.parquet', hive_partitioning=true, union_by_name=true)"
-            con.execute(sql)
+            sql = f"CREATE OR REPLACE VIEW {view_name} AS SELECT * FROM read_parquet('{proc_path}/**/*.parquet', hive_partitioning=true{extra})"
+            with _con_lock:
+                con.execute(sql)
             print(f"  🐢 [标准模式] View [{view_name}] registered")
         except Exception as e:
             print(f"  ❌ Failed: {view_name}: {e}")
@@ -64,9 +87,14 @@ views_map = {
     "market_pb":     "market_pb_all"
 }
 
+# stock_financial 的列集来自每只股票自己的指标名，逐文件并不一致，
+# 必须 union_by_name 让 DuckDB 按列名合并 Schema (其余数据集保持快路径)
+UNION_BY_NAME_FOLDERS = {"stock_financial"}
+
 print("正在注册视图...")
-for view, folder in views_map.items():
-    register_smart_view(view, folder)
+with ThreadPoolExecutor(max_workers=len(views_map)) as pool:
+    for view, folder in views_map.items():
+        pool.submit(register_smart_view, view, folder, folder in UNION_BY_NAME_FOLDERS)
 
 print("-" * 80)
 
@@ -74,70 +102,83 @@ print("-" * 80)
 # 第二步：查询演示 (查看最新一行数据)
 # ==============================================================================
 
-def print_data(title, sql):
-    """通用函数：执行SQL并打印第一行数据"""
+# 打开后额外执行带谓词的 LIMIT 1 查询并打印首行数据；
+# 默认关闭: 看字段只需查目录元数据 (duckdb_columns)，完全不扫 Parquet 数据页
+SHOW_SAMPLE_ROW = False
+
+def print_data(title, view_name, sample_sql=None):
+    """通用函数：打印视图字段列表 (可选执行示例查询打印首行数据)"""
     print(f"--- {title} ---")
     try:
-        # 使用 LIMIT 1 快速获取 Schema，不读取大量数据
-        df = con.query(sql).df()
-        cols = df.columns.tolist()
+        # 纯元数据查询: 零数据读取
+        rows = con.execute(
+            "SELECT column_name FROM duckdb_columns() WHERE table_name = ?",
+            [view_name]
+        ).fetchall()
+        cols = [r[0] for r in rows]
         print(f"📊 字段数量: {len(cols)}")
-        print(f"📝 字段示例: {df}")
+        suffix = " ..." if len(cols) > 20 else ""
+        print(f"📝 字段列表: {cols[:20]}{suffix}")
+
+        if SHOW_SAMPLE_ROW and sample_sql:
+            df = con.query(sample_sql).df()
+            if not df.empty:
+                print(f"📄 首行示例: {df.iloc[0].to_dict()}")
     except Exception as e:
         print(f"❌ 查询失败: {e}")
     print("\n")
 
 # 1. 个股查询
-print_data("1. 个股行情 (stock_kline)", """
-    SELECT * FROM stock_kline 
-    WHERE code = 'sh.600519' 
+print_data("1. 个股行情 (stock_kline)", "stock_kline", """
+    SELECT * FROM stock_kline
+    WHERE code = 'sh.600519'
     LIMIT 1
 """)
 
 # 2. 财务查询
 # 注意：finance 表字段非常多，包含 balance, income, cashflow 三张表的合集
-print_data("2. 财务指标 (finance)", """
-    SELECT * FROM finance 
-    WHERE code = 'sz.300750' AND year >= 2023 
+print_data("2. 财务指标 (finance)", "finance", """
+    SELECT * FROM finance
+    WHERE code = 'sz.300750' AND year >= 2023
     LIMIT 1
 """)
 
 # 3. 指数查询
-print_data("3. 指数行情 (index_kline)", """
-    SELECT * FROM index_kline 
-    WHERE code = 'sh.000001' 
+print_data("3. 指数行情 (index_kline)", "index_kline", """
+    SELECT * FROM index_kline
+    WHERE code = 'sh.000001'
     LIMIT 1
 """)
 
 # 4. ETF查询
-print_data("4. ETF行情 (etf_kline)", """
-    SELECT * FROM etf_kline 
-    WHERE name = 'HS300' 
+print_data("4. ETF行情 (etf_kline)", "etf_kline", """
+    SELECT * FROM etf_kline
+    WHERE name = 'HS300'
     LIMIT 1
 """)
 
 # 5. 概念查询
-print_data("5. 概念板块 (concept_kline)", """
-    SELECT * FROM concept_kline 
-    WHERE concept_name = 'AI智能体' 
+print_data("5. 概念板块 (concept_kline)", "concept_kline", """
+    SELECT * FROM concept_kline
+    WHERE concept_name = 'AI智能体'
     LIMIT 1
 """)
 
 # 6. 宏观查询
-print_data("6. 宏观经济 (macro)", """
-    SELECT * FROM macro 
+print_data("6. 宏观经济 (macro)", "macro", """
+    SELECT * FROM macro
     LIMIT 1
 """)
 
 # 7. 新闻查询
-print_data("7. 新闻联播 (news)", """
-    SELECT * FROM news 
+print_data("7. 新闻联播 (news)", "news", """
+    SELECT * FROM news
     LIMIT 1
 """)
 
 # 8. 行业PE查询
-print_data("8. 行业PE/PB (industry_pe)", """
-    SELECT * FROM industry_pe 
+print_data("8. 行业PE/PB (industry_pe)", "industry_pe", """
+    SELECT * FROM industry_pe
     LIMIT 1
 """)
 
@@ -9,10 +9,14 @@ AlphaFactorLab 数据更新主程序 (高度解耦版 + 指定代码 + 历史全
 """
 
 import argparse
+import contextlib
 import datetime
+import functools
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from typing import Tuple, List, Optional
+from typing import Callable, Tuple, List, Optional
 import random
 import warnings
 import pandas as pd       # [新增] 用于读取 csv
@@ -28,7 +32,10 @@ from src.fetchers.akshare_api import AkshareFetcher
 from src.fetchers.mootdx_api import MootdxFetcher
 from src.processors.cleaner import DataCleaner
 from src.storage.parquet_manager import ParquetStorage
+from src.storage.optimizer import build_optimized_views
 from src.utils.logger import get_logger
+from src.utils.code_utils import filter_stock_codes
+from src.utils.rate_limiter import RateLimiter
 
 # 配置日志
 logger = get_logger("Main", "data_update.log")
@@ -36,8 +43,21 @@ logger = get_logger("Main", "data_update.log")
 # 本地全量股票名单路径 (由 universe_generator.py 生成)
 LOCAL_STOCK_LIST_PATH = Path("config/all_stock_list.csv")
 
+# 当前在市股票列表缓存: --task all 时 stock 和 finance 都要这份列表，
+# 只拉一次网络，避免重复的 Baostock 往返
+_active_codes_cache: Optional[List[str]] = None
+
+# 本地 CSV 名单同理: full 模式下 stock 和 finance 各调一次 load_stock_scope，
+# CSV 解析一次后进程内复用
+_local_codes_cache: Optional[List[str]] = None
+
+@functools.lru_cache(maxsize=4)
 def get_date_range(mode: str) -> Tuple[str, str]:
-    """计算时间范围: update模式回溯到当年1月1日"""
+    """
+    计算时间范围: update模式回溯到当年1月1日
+    lru_cache 顺带冻结 today(): --task all 跨零点运行时各子任务拿到同一个 end_date，
+    分区键不会出现前后不一致
+    """
     end_date = datetime.date.today().strftime('%Y-%m-%d')
     if mode == 'full':
         start_date = START_DATE_FULL
@@ -59,7 +79,11 @@ def load_stock_scope(bs_fetcher: BaostockFetcher, mode: str, specific_codes: Opt
         logger.info(f"🎯 Target: {len(specific_codes)} specific stocks.")
         return specific_codes
 
+    global _local_codes_cache
     if mode == 'full':
+        if _local_codes_cache is not None:
+            logger.info(f"♻️ Reusing cached historical universe ({len(_local_codes_cache)} stocks).")
+            return _local_codes_cache
         if LOCAL_STOCK_LIST_PATH.exists():
             logger.info(f"📜 [Full Mode] Loading historical universe from {LOCAL_STOCK_LIST_PATH}...")
             try:
@@ -67,6 +91,7 @@ def load_stock_scope(bs_fetcher: BaostockFetcher, mode: str, specific_codes: Opt
                 if 'code' in df.columns:
                     codes = df['code'].tolist()
                     logger.info(f"✅ Loaded {len(codes)} stocks (including delisted).")
+                    _local_codes_cache = codes
                     return codes
             except Exception as e:
                 logger.error(f"❌ Failed to read local list: {e}")
@@ -74,25 +99,54 @@ def load_stock_scope(bs_fetcher: BaostockFetcher, mode: str, specific_codes: Opt
             logger.warning("⚠️ [Full Mode] Local list not found! Please run 'src/utils/universe_generator.py' first.")
             logger.warning("⚠️ Fallback to fetching CURRENT active stocks only.")
 
-    # Fallback or Update mode: 获取当前在线股票
+    # Fallback or Update mode: 获取当前在线股票 (进程内缓存)
+    global _active_codes_cache
+    if _active_codes_cache is not None:
+        logger.info(f"♻️ Reusing cached active stock list ({len(_active_codes_cache)} stocks).")
+        return _active_codes_cache
+
     logger.info("📡 Fetching CURRENT active stock list from Baostock...")
     raw_codes = bs_fetcher.fetch_all_stock_codes()
     # 过滤指数
-    stock_codes = [c for c in raw_codes if not (c.startswith("sh.000") or c.startswith("sz.399"))]
+    stock_codes = filter_stock_codes(raw_codes)
     logger.info(f"✅ Found {len(stock_codes)} active stocks.")
+    _active_codes_cache = stock_codes
     return stock_codes
 
+def borrow_baostock(bs: Optional[BaostockFetcher]):
+    """
+    [新增辅助函数] 复用已登录的 Baostock 会话
+    登录是一次 ~1s 的网络往返，--task all 时各任务共享 __main__ 里的同一个会话；
+    单任务运行时 (bs=None) 各自开关，行为不变。
+    """
+    return BaostockFetcher() if bs is None else contextlib.nullcontext(bs)
+
+def run_parallel(worker: Callable, items: list, max_workers: int, desc: str):
+    """
+    [新增辅助函数] 用有界线程池并发执行 I/O 密集型任务
+    逻辑: 单条请求大部分时间在等网络，串行跑会让网络空闲 >95%。
+    max_workers 用于控制并发度，避免触发数据源限流 (Baostock 可高一些，同花顺要低)。
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(worker, item): item for item in items}
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+            item = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Failed {desc} {item}: {e}")
+
 # ==========================================
 # 1. 📈 指数 (Index)
 # ==========================================
-def run_index_update(mode: str):
+def run_index_update(mode: str, bs: Optional[BaostockFetcher] = None):
     start_date, end_date = get_date_range(mode)
     logger.info(f"🚀 Starting INDEX update ({mode}): {start_date} -> {end_date}")
-    
+
     storage = ParquetStorage(PROCESSED_DIR)
     cleaner = DataCleaner()
-    
-    with BaostockFetcher() as bs:
+
+    with borrow_baostock(bs) as bs:
         logger.info(f"Updating {len(INDEX_POOL)} Indexes...")
         for code in INDEX_POOL:
             df = bs.fetch_index_kline(code, start_date, end_date)
@@ -103,26 +157,50 @@ def run_index_update(mode: str):
 # ==========================================
 # 2. 📈 个股 (Stock)
 # ==========================================
-def run_stock_update(mode: str, specific_codes: Optional[List[str]] = None):
+def run_stock_update(mode: str, specific_codes: Optional[List[str]] = None,
+                     bs: Optional[BaostockFetcher] = None):
     start_date, end_date = get_date_range(mode)
     logger.info(f"🚀 Starting STOCK update ({mode}): {start_date} -> {end_date}")
-    
+
     storage = ParquetStorage(PROCESSED_DIR)
     cleaner = DataCleaner()
-    
-    with BaostockFetcher() as bs:
+
+    with borrow_baostock(bs) as bs:
         # 使用新逻辑加载股票列表
         stock_codes = load_stock_scope(bs, mode, specific_codes)
-        
-        for code in tqdm(stock_codes, desc="Stocks"):
-            try:
-                # adjust='1' 后复权
-                df = bs.fetch_daily_kline(code, start_date, end_date, adjust='1')
-                if not df.empty:
-                    df = cleaner.clean_daily_market_data(df)
-                    storage.save_partitioned(df, "stock_price_daily", key_col='code')
-            except Exception as e:
-                logger.error(f"Failed stock {code}: {e}")
+
+        # 全量模式顺带产出合并大文件 (optimized 极速层: 单文件 + 每股一个 Row Group)
+        # update 模式只含当年数据，写极速层会遮盖历史，所以跳过
+        batch_writer = None
+        if mode == 'full' and not specific_codes:
+            batch_writer = storage.open_batch_writer("stock_price_daily")
+
+        def fetch_one(code: str):
+            # 增量模式先探一眼已有分区的 Footer 统计: 今天已经更新过的标的直接跳过
+            # (只跳不截断 start_date —— 分区按年整文件覆盖，部分区间抓取会丢掉年初数据)
+            if mode == 'update':
+                last = storage.get_max_date("stock_price_daily", code)
+                if last is not None and str(last) >= end_date:
+                    return
+
+            # adjust='1' 后复权
+            df = bs.fetch_daily_kline(code, start_date, end_date, adjust='1')
+            if not df.empty:
+                df = cleaner.clean_daily_market_data(df)
+                storage.save_partitioned(df, "stock_price_daily", key_col='code')
+                if batch_writer is not None:
+                    # optimized 层的另一个生产者 (build_optimized_views) 会带上
+                    # hive 分区里的 year 列；这里补同样的列，两条生产路径的
+                    # Schema 保持一致，下游 SQL 不用关心文件是谁写的
+                    year = pd.to_datetime(df['date']).dt.year.astype('int64')
+                    batch_writer.append(df.assign(year=year))
+
+        # Baostock 请求本身被 fetcher 内的全局锁串行化 (协议不支持并发)，
+        # 多 worker 的收益在于清洗/写盘与下一条下载相互重叠
+        run_parallel(fetch_one, stock_codes, max_workers=8, desc="Stocks")
+
+        if batch_writer is not None:
+            batch_writer.close()
 
 # ==========================================
 # 3. 📊 ETF (Mootdx)
@@ -133,49 +211,60 @@ def run_etf_update(mode: str):
     storage = ParquetStorage(PROCESSED_DIR)
     cleaner = DataCleaner()
     
-    with MootdxFetcher() as mdx:
-        for name, (code, ipo_year) in tqdm(ETF_POOL.items(), desc="ETFs"):
-            try:
-                df = mdx.fetch_etf_daily_kline(code, ipo_year, start_date, end_date, adjust_factor='02')
-                if not df.empty:
-                    df['name'] = name 
-                    df = cleaner.clean_daily_market_data(df)
-                    storage.save_partitioned(df, "etf_price_daily", key_col='name')
-            except Exception as e:
-                logger.error(f"Failed ETF {name}: {e}")
+    # Mootdx 会话不能跨线程共享，但 TDX 协议允许多条并发连接:
+    # 每个 worker 线程懒加载一个自己的 Fetcher，结束后统一关闭
+    tls = threading.local()
+    opened_fetchers = []
+
+    def get_mdx() -> MootdxFetcher:
+        if not hasattr(tls, 'mdx'):
+            tls.mdx = MootdxFetcher()
+            opened_fetchers.append(tls.mdx)
+        return tls.mdx
+
+    def fetch_one(item):
+        name, (code, ipo_year) = item
+        df = get_mdx().fetch_etf_daily_kline(code, ipo_year, start_date, end_date, adjust_factor='02')
+        if not df.empty:
+            df['name'] = name
+            df = cleaner.clean_daily_market_data(df)
+            storage.save_partitioned(df, "etf_price_daily", key_col='name')
+
+    try:
+        run_parallel(fetch_one, list(ETF_POOL.items()), max_workers=4, desc="ETFs")
+    finally:
+        for mdx in opened_fetchers:
+            mdx.__exit__(None, None, None)
 
 # ==========================================
 # 4. 💰 财务报表 (Finance)
 # ==========================================
-def run_finance_update(mode: str, specific_codes: Optional[List[str]] = None):
+def run_finance_update(mode: str, specific_codes: Optional[List[str]] = None,
+                       bs: Optional[BaostockFetcher] = None):
     logger.info(f"🚀 Starting FINANCIAL REPORT update (Finance + Dividend + Baostock)")
-    
+
     storage = ParquetStorage(PROCESSED_DIR)
     cleaner = DataCleaner()
     ak_fetcher = AkshareFetcher()
-    
+
     # 确定 Baostock 的抓取年份范围
     current_year = datetime.date.today().year
     if mode == 'full':
-        bs_start_year = 2007 
+        bs_start_year = 2007
     else:
         bs_start_year = current_year - 1 # update模式只抓近两年，为了速度
 
-    # 1. 获取任务列表 (复用 Baostock 连接)
-    with BaostockFetcher() as bs_main:
-        stock_codes = load_stock_scope(bs_main, mode, specific_codes)
-        
-    logger.info(f"Updating Financial Reports for {len(stock_codes)} stocks...")
-    
-    # 2. 开启 Baostock 连接用于循环抓取
-    with BaostockFetcher() as bs_fetcher:
-        
-        for code in tqdm(stock_codes, desc="Finance"):
+    # 同一个会话既取任务列表又做循环抓取，不再重复登录
+    with borrow_baostock(bs) as bs_fetcher:
+        stock_codes = load_stock_scope(bs_fetcher, mode, specific_codes)
+        logger.info(f"Updating Financial Reports for {len(stock_codes)} stocks...")
+
+        def fetch_one(code: str):
             try:
                 # --- Step A: 获取主财报 (Akshare) ---
                 df_main = ak_fetcher.fetch_financial_report(code)
                 if df_main.empty:
-                    continue
+                    return
                 df_main = cleaner.clean_financial_report(df_main)
 
                 # --- Step B: 获取补充数据 (Baostock) ---
@@ -218,10 +307,13 @@ def run_finance_update(mode: str, specific_codes: Optional[List[str]] = None):
                 
                 # 随机休眠 (同花顺接口敏感)
                 time.sleep(random.uniform(1.5, 3.0))
-                
+
             except Exception as e:
-                # logger.error(f"Error {code}: {e}") # 调试时可解开
-                pass
+                # 记录错误类型: 429/封锁类错误被静默吞掉的话会一直空转浪费请求
+                logger.warning(f"Finance {code} failed: {type(e).__name__}: {e}")
+
+        # 同花顺接口对并发敏感，只开 2 个 worker，配合休眠控制请求频率
+        run_parallel(fetch_one, stock_codes, max_workers=2, desc="Finance")
 
 # ==========================================
 # 5. 💡 概念板块 (Concept)
@@ -243,17 +335,24 @@ def run_concept_update(mode: str):
     end_str = end_date.replace("-", "")
     
     logger.info(f"Updating {len(df_concepts)} Concept Boards...")
-    for _, row in tqdm(df_concepts.iterrows(), total=len(df_concepts), desc="Concept"):
-        name = row['name']
+
+    # 令牌桶限流: 只在超出每秒预算时才等待，不再每个板块固定睡 0.3s
+    limiter = RateLimiter(rps=3)
+
+    def fetch_one(name: str):
         try:
+            limiter.acquire()
             df_daily = ak_fetcher.fetch_concept_daily(name, start_str, end_str)
             if not df_daily.empty:
                 df_daily['concept_name'] = name
                 df_daily = cleaner.clean_daily_market_data(df_daily)
                 storage.save_partitioned(df_daily, "concept_price_daily", key_col='concept_name')
-            
-            time.sleep(0.3) 
-        except: pass
+        except Exception as e:
+            # 只吞 Exception，让 Ctrl-C (KeyboardInterrupt) 能正常中断长任务
+            logger.warning(f"Concept '{name}' failed: {type(e).__name__}: {e}")
+
+    # 同花顺源，保守并发
+    run_parallel(fetch_one, df_concepts['name'].tolist(), max_workers=2, desc="Concept")
 
 # ==========================================
 # 6. 🗞️ 另类数据
@@ -266,18 +365,31 @@ def run_alt_news(mode: str):
     cleaner = DataCleaner()
     ak_fetcher = AkshareFetcher()
     
-    start = datetime.datetime.strptime(start_date, "%Y-%m-%d") 
-    end = datetime.datetime.strptime(end_date, "%Y-%m-%d")
-    date_generated = [start + datetime.timedelta(days=x) for x in range(0, (end-start).days + 1)]
-    
-    for date_obj in tqdm(date_generated, desc="CCTV News"):
-        date_str = date_obj.strftime("%Y%m%d")
-        try:
-            df_news = ak_fetcher.fetch_cctv_news(date_str)
-            if not df_news.empty:
-                df_news = cleaner.clean_news_data(df_news)
-                storage.save_partitioned(df_news, "alt_cctv_news", key_col='date')
-        except: pass
+    # 向量化生成日期串，省掉逐日 timedelta + strftime 的 Python 循环
+    date_strs = pd.date_range(start_date, end_date, freq='D').strftime('%Y%m%d').tolist()
+
+    # 接口只支持单日查询，只能并发抓取；写盘改为按月合并，
+    # 避免生成上千个单日小 Parquet (DuckDB 扫描元数据的反模式)
+    results = []
+
+    def fetch_one(date_str: str):
+        df_news = ak_fetcher.fetch_cctv_news(date_str)
+        if not df_news.empty:
+            results.append(df_news)
+
+    run_parallel(fetch_one, date_strs, max_workers=4, desc="CCTV News")
+
+    if not results:
+        return
+
+    df_all = pd.concat(results, ignore_index=True)
+    df_all = cleaner.clean_news_data(df_all)
+    if 'date' not in df_all.columns or df_all.empty:
+        return
+
+    # 分区粒度: year=YYYY/month=YYYY-MM，一次 COPY 由 DuckDB 并行切分写入
+    df_all['month'] = pd.to_datetime(df_all['date']).dt.strftime('%Y-%m')
+    storage.save_bulk_partitioned(df_all, "alt_cctv_news", key_col='month')
 
 def run_alt_industry_pe(mode: str):
     start_date, end_date = get_date_range(mode)
@@ -287,20 +399,29 @@ def run_alt_industry_pe(mode: str):
     cleaner = DataCleaner()
     ak_fetcher = AkshareFetcher()
     
-    start = datetime.datetime.strptime('2023-05-19', "%Y-%m-%d")
-    end = datetime.datetime.strptime(end_date, "%Y-%m-%d")
-    date_generated = [start + datetime.timedelta(days=x) for x in range(0, (end-start).days + 1)]
-    
-    for date_obj in tqdm(date_generated, desc="Industry PE"):
-        date_str = date_obj.strftime("%Y%m%d")
-        try:
-            df_pe = ak_fetcher.fetch_industry_pe_snapshot(date_str)
-            if not df_pe.empty:
-                if '变动日期' in df_pe.columns:
-                    df_pe.rename(columns={'变动日期': 'date'}, inplace=True)
-                    df_pe = cleaner.normalize_date(df_pe)
-                    storage.save_partitioned(df_pe, "industry_pe_daily", key_col='date')
-        except: pass
+    # 接口自 2023-05-19 起才有数据；向量化生成日期串
+    date_strs = pd.date_range('2023-05-19', end_date, freq='D').strftime('%Y%m%d').tolist()
+
+    # 同 run_alt_news: 并发单日抓取 + 按月合并落盘
+    results = []
+
+    def fetch_one(date_str: str):
+        df_pe = ak_fetcher.fetch_industry_pe_snapshot(date_str)
+        if not df_pe.empty and '变动日期' in df_pe.columns:
+            results.append(df_pe.rename(columns={'变动日期': 'date'}))
+
+    run_parallel(fetch_one, date_strs, max_workers=4, desc="Industry PE")
+
+    if not results:
+        return
+
+    df_all = pd.concat(results, ignore_index=True)
+    df_all = cleaner.normalize_date(df_all)
+    if 'date' not in df_all.columns or df_all.empty:
+        return
+
+    df_all['month'] = pd.to_datetime(df_all['date']).dt.strftime('%Y-%m')
+    storage.save_bulk_partitioned(df_all, "industry_pe_daily", key_col='month')
 
 def run_alt_market_metric(mode: str):
     logger.info(f"🚀 Starting ALT: Market Metrics (PE/PB) update")
@@ -321,9 +442,16 @@ def run_alt_market_metric(mode: str):
         logger.error(f"Failed to update market metrics: {e}")
 
 def run_alt_all(mode: str):
-    run_alt_news(mode)
-    run_alt_industry_pe(mode)
-    run_alt_market_metric(mode)
+    # 三个 alt 任务互不依赖 (各自实例化 Storage/Cleaner/Fetcher，数据集也不同)，
+    # 并行跑总耗时从三者之和降到三者最大值
+    tasks = [run_alt_news, run_alt_industry_pe, run_alt_market_metric]
+    with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+        futures = {pool.submit(t, mode): t.__name__ for t in tasks}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Failed {futures[future]}: {e}")
 
 # ==========================================
 # 主入口
@@ -344,10 +472,12 @@ if __name__ == "__main__":
     start_time = time.time()
     
     if args.task == 'all':
-        run_index_update(args.mode)
-        run_stock_update(args.mode)
-        run_etf_update(args.mode)
-        run_finance_update(args.mode)
+        # Baostock 任务共享一个已登录会话，省掉重复登录的网络往返
+        with BaostockFetcher() as bs_session:
+            run_index_update(args.mode, bs=bs_session)
+            run_stock_update(args.mode, bs=bs_session)
+            run_etf_update(args.mode)
+            run_finance_update(args.mode, bs=bs_session)
         run_concept_update(args.mode)
         run_alt_all(args.mode)
     
@@ -378,5 +508,8 @@ if __name__ == "__main__":
     elif args.task == 'alt_market_metric':
         run_alt_market_metric(args.mode)
         
+    # 更新完成后物化 optimized 极速层 (mtime 没变的数据集会自动跳过)
+    build_optimized_views()
+
     elapsed = time.time() - start_time
     logger.info(f"🎉 Task '{args.task}' completed in {elapsed:.2f} seconds.")
\ No newline at end of file
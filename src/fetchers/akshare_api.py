@@ -6,20 +6,77 @@ Akshare 数据抽取接口 (修正版)
 """
 
 import akshare as ak
+import contextlib
 import pandas as pd
+import requests
 import sys
+import threading
 from pathlib import Path
 import time # 引入time
+import random
 from json import JSONDecodeError # 引入具体的错误类型
+from requests.adapters import HTTPAdapter
+
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    Retry = None
 
 # 🚑 路径补丁
 project_root = str(Path(__file__).resolve().parents[2])
 if project_root not in sys.path:
     sys.path.append(project_root)
 
+from src.utils.rate_limiter import RateLimiter
+
+# 主动限速: 反爬触发后再退避是亡羊补牢，先把对同花顺的请求压在经验预算
+# (5 req/s) 之内，多数情况下根本走不到封锁分支。全模块共享一个预算。
+_THS_LIMITER = RateLimiter(rps=5)
+
+# 共享 HTTP 会话: akshare 内部直接调用 requests.get/post，每次都是新建连接
+# (TCP+TLS 握手)，换成连接池会话后几千次抓取复用长连接。
+# ⚠️ 不做进程级的永久替换: 那会让进程里所有无关库共享同一个 cookie 罐和
+# 重试策略。只在 ak.* 调用期间临时把模块函数指到会话上，调完即还原。
+_shared_session = None
+_session_lock = threading.Lock()
+_orig_get, _orig_post = requests.get, requests.post
+_patch_depth = 0
+
+def _get_shared_session():
+    global _shared_session
+    with _session_lock:
+        if _shared_session is None:
+            session = requests.Session()
+            retries = Retry(total=3, backoff_factor=0.5) if Retry else 3
+            adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retries)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _shared_session = session
+    return _shared_session
+
+@contextlib.contextmanager
+def _akshare_session():
+    """
+    akshare 没有会话注入口，只能在调用窗口内把 requests.get/post 指向共享会话。
+    引用计数让多线程的 ak.* 调用可以安全交叠，最后一个退出者负责还原原函数。
+    """
+    global _patch_depth
+    session = _get_shared_session()
+    with _session_lock:
+        if _patch_depth == 0:
+            requests.get, requests.post = session.get, session.post
+        _patch_depth += 1
+    try:
+        yield session
+    finally:
+        with _session_lock:
+            _patch_depth -= 1
+            if _patch_depth == 0:
+                requests.get, requests.post = _orig_get, _orig_post
+
 class AkshareFetcher:
     def __init__(self):
-        pass
+        self._session = _get_shared_session()
 
     # =================================================
     # 1. 💰 个股财务数据 (Financial)
@@ -31,23 +88,31 @@ class AkshareFetcher:
         """
         code_str = self._format_code(code)
         
-        # 简单的重试机制
-        max_retries = 3
+        # 指数退避重试: 反爬封锁通常几十秒就解除，固定睡 600s 会让整批任务
+        # 在一次封锁上干等 10 分钟。从 5s 起倍增、封顶 120s，加随机抖动
+        # 避免多个 worker 同时醒来再次齐射触发封锁。
+        max_retries = 5
+        base_delay = 5
+        max_delay = 120
         for i in range(max_retries):
             try:
-                df = ak.stock_financial_abstract(symbol=code_str)
-                
+                _THS_LIMITER.acquire()
+                with _akshare_session():
+                    df = ak.stock_financial_abstract(symbol=code_str)
+
                 if df is None or df.empty:
                     return pd.DataFrame()
 
                 # 手动注入 code
-                df['code'] = code 
+                df['code'] = code
                 return df
-            
+
             except JSONDecodeError:
                 # 这是最关键的捕获：说明被反爬了
-                print(f"⚠️ [Anti-Scraping] JSON Error for {code}. Retrying ({i+1}/{max_retries})...")
-                time.sleep(600) # 遇到封锁，多睡一会
+                delay = min(max_delay, base_delay * (2 ** i)) + random.uniform(0, base_delay)
+                print(f"⚠️ [Anti-Scraping] JSON Error for {code}. "
+                      f"Retrying in {delay:.0f}s ({i+1}/{max_retries})...")
+                time.sleep(delay)
                 continue
                 
             except Exception as e:
@@ -67,7 +132,9 @@ class AkshareFetcher:
         """
         code_str = self._format_code(code)
         try:
-            df = ak.stock_fhps_detail_ths(symbol=code_str)
+            _THS_LIMITER.acquire()
+            with _akshare_session():
+                df = ak.stock_fhps_detail_ths(symbol=code_str)
             if df is None or df.empty:
                 return pd.DataFrame()
             
@@ -83,50 +150,72 @@ class AkshareFetcher:
     def fetch_concept_boards(self) -> pd.DataFrame:
         try:
             print("正在获取同花顺概念板块列表...")
-            return ak.stock_board_concept_name_ths()
+            with _akshare_session():
+                return ak.stock_board_concept_name_ths()
         except Exception as e:
             print(f"❌ Error fetching THS concept boards: {e}")
             return pd.DataFrame()
 
     def fetch_concept_daily(self, concept_name: str, start_date: str, end_date: str) -> pd.DataFrame:
         try:
-            df = ak.stock_board_concept_index_ths(
-                symbol=concept_name, 
-                start_date=start_date, 
-                end_date=end_date
-            )
+            _THS_LIMITER.acquire()
+            with _akshare_session():
+                df = ak.stock_board_concept_index_ths(
+                    symbol=concept_name,
+                    start_date=start_date,
+                    end_date=end_date
+                )
             if df is None or df.empty: return pd.DataFrame()
 
             rename_map = {'日期': 'date', '开盘价': 'open', '最高价': 'high','最低价': 'low', '收盘价': 'close', '成交量': 'volume', '成交额': 'amount'}
             df = df.rename(columns=rename_map)
-            df['date'] = pd.to_datetime(df['date'])
-            for col in ['open', 'high', 'low', 'close', 'volume', 'amount']:
-                if col in df.columns: df[col] = pd.to_numeric(df[col], errors='coerce')
+            # THS 固定返回 'YYYY-MM-DD'，指定 format 走 C 级快路径，跳过逐值推断
+            try:
+                df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d', cache=True)
+            except (ValueError, TypeError):
+                df['date'] = pd.to_datetime(df['date'])
+            # 一次 apply 批量转换，不再逐列发起 6 次独立的 cast
+            existing = [c for c in ['open', 'high', 'low', 'close', 'volume', 'amount'] if c in df.columns]
+            if existing:
+                df[existing] = df[existing].apply(pd.to_numeric, errors='coerce')
             return df
         except Exception: return pd.DataFrame()
 
     # =================================================
     # 3. 另类数据
     # =================================================
+    # 注意: 这里只捕获 Exception (空数据日/接口抖动返回空表即可)，
+    # 不能用裸 except，否则 KeyboardInterrupt 也会被吞掉
     def fetch_industry_pe_snapshot(self, date: str) -> pd.DataFrame:
-        try: return ak.stock_industry_pe_ratio_cninfo(symbol="证监会行业分类", date=date)
-        except: return pd.DataFrame()
+        try:
+            with _akshare_session():
+                return ak.stock_industry_pe_ratio_cninfo(symbol="证监会行业分类", date=date)
+        except Exception: return pd.DataFrame()
 
     def fetch_cctv_news(self, date: str) -> pd.DataFrame:
-        try: return ak.news_cctv(date=date)
-        except: return pd.DataFrame()
+        try:
+            with _akshare_session():
+                return ak.news_cctv(date=date)
+        except Exception: return pd.DataFrame()
 
     def fetch_market_pe(self) -> pd.DataFrame:
-        try: return ak.stock_market_pe_lg(symbol="上证")
-        except: return pd.DataFrame()
+        try:
+            with _akshare_session():
+                return ak.stock_market_pe_lg(symbol="上证")
+        except Exception: return pd.DataFrame()
 
     def fetch_market_pb(self) -> pd.DataFrame:
-        try: return ak.stock_a_all_pb()
-        except: return pd.DataFrame()
+        try:
+            with _akshare_session():
+                return ak.stock_a_all_pb()
+        except Exception: return pd.DataFrame()
 
     def _format_code(self, code: str) -> str:
-        if isinstance(code, str) and (code.startswith("sh.") or code.startswith("sz.") or code.startswith("bj.")):
-            return code.split(".")[1]
+        # partition 一次 C 级扫描完成前缀判断+取后缀，替代 3 次 startswith + split
+        if isinstance(code, str):
+            prefix, sep, suffix = code.partition(".")
+            if sep and prefix in ("sh", "sz", "bj"):
+                return suffix
         return str(code)
 
 # --- 测试逻辑 ---
@@ -8,8 +8,9 @@ import baostock as bs
 import pandas as pd
 import datetime
 import sys
+import threading
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 # 🚑 路径补丁
 project_root = str(Path(__file__).resolve().parents[2])
@@ -17,6 +18,14 @@ if project_root not in sys.path:
     sys.path.append(project_root)
 
 from src.utils.date_utils import get_latest_trading_date
+from config.settings import CACHE_DIR
+
+# ⚠️ Baostock 不是线程安全的: 底层只有一条进程级 socket (context.default_socket)，
+# send/recv 没有任何同步，分页 (rs.next) 还会在同一条 socket 上继续发请求。
+# 并发查询会让一个线程读到另一个线程的响应 (协议里的请求序列号字段被注释掉了，
+# 串台无法被检测)，静默把 A 股票的数据挂到 B 股票名下。
+# 因此所有 Baostock 请求 (查询 + 完整分页消费) 必须串行，全进程共用这把锁。
+_BAOSTOCK_LOCK = threading.Lock()
 
 class BaostockFetcher:
     DAILY_FIELDS = (
@@ -27,6 +36,9 @@ class BaostockFetcher:
 
     def __init__(self):
         self._is_login = False
+        # bs 的会话是进程级全局的，一次 login 全线程共用；
+        # 查询级的互斥由模块级 _BAOSTOCK_LOCK 负责，这把锁只管 _is_login 状态
+        self._session_lock = threading.Lock()
 
     def __enter__(self):
         self.login()
@@ -36,17 +48,19 @@ class BaostockFetcher:
         self.logout()
 
     def login(self):
-        if not self._is_login:
-            lg = bs.login()
-            if lg.error_code == '0':
-                self._is_login = True
-            else:
-                print(f"❌ Baostock login failed: {lg.error_msg}")
+        with self._session_lock:
+            if not self._is_login:
+                lg = bs.login()
+                if lg.error_code == '0':
+                    self._is_login = True
+                else:
+                    print(f"❌ Baostock login failed: {lg.error_msg}")
 
     def logout(self):
-        if self._is_login:
-            bs.logout()
-            self._is_login = False
+        with self._session_lock:
+            if self._is_login:
+                bs.logout()
+                self._is_login = False
 
     def fetch_all_stock_codes(self, date: str = None) -> List[str]:
         """
@@ -61,23 +75,22 @@ class BaostockFetcher:
 
         for i in range(max_retries):
             query_date = current_date_obj.strftime("%Y-%m-%d")
-            
-            rs = bs.query_all_stock(day=query_date)
-            
-            if rs.error_code != '0':
-                # 接口报错，跳过
-                pass
-            else:
+
+            # 查询和分页消费都在锁内完成，避免与其他线程的请求在 socket 上串台
+            with _BAOSTOCK_LOCK:
+                rs = bs.query_all_stock(day=query_date)
+
                 stock_list = []
-                while rs.next():
-                    stock_list.append(rs.get_row_data()[0])
-                
-                # 如果获取到了数据，直接返回
-                if stock_list:
-                    if i > 0:
-                        print(f"⚠️ Initial date {date} empty, fell back to {query_date} (Found {len(stock_list)} stocks)")
-                    return stock_list
-            
+                if rs.error_code == '0':
+                    while rs.next():
+                        stock_list.append(rs.get_row_data()[0])
+
+            # 如果获取到了数据，直接返回
+            if stock_list:
+                if i > 0:
+                    print(f"⚠️ Initial date {date} empty, fell back to {query_date} (Found {len(stock_list)} stocks)")
+                return stock_list
+
             # 如果没获取到数据，日期减1天，继续尝试
             current_date_obj -= datetime.timedelta(days=1)
 
@@ -85,37 +98,99 @@ class BaostockFetcher:
         return []
 
     def fetch_daily_kline(self, code: str, start_date: str, end_date: str, adjust: str = "3") -> pd.DataFrame:
-        rs = bs.query_history_k_data_plus(
-            code, self.DAILY_FIELDS,
-            start_date=start_date, end_date=end_date,
-            frequency="d", adjustflag=adjust
-        )
-        return self._process_result(rs)
+        with _BAOSTOCK_LOCK:
+            rs = bs.query_history_k_data_plus(
+                code, self.DAILY_FIELDS,
+                start_date=start_date, end_date=end_date,
+                frequency="d", adjustflag=adjust
+            )
+            return self._process_result(rs)
+
+    def fetch_daily_kline_batch(self, codes: List[str], start_date: str, end_date: str,
+                                adjust: str = "3") -> Dict[str, pd.DataFrame]:
+        """
+        批量拉取多只股票的日K
+        说明: Baostock 请求必须串行 (见 _BAOSTOCK_LOCK)，这里不再开线程池
+        对着互斥锁空转；批量的价值只在于统一的错误兜底。
+        :return: {code: DataFrame}，失败或空数据的 code 映射到空表
+        """
+        results: Dict[str, pd.DataFrame] = {}
+        for code in codes:
+            try:
+                results[code] = self.fetch_daily_kline(code, start_date, end_date, adjust)
+            except Exception as e:
+                print(f"⚠️ Batch kline failed for {code}: {e}")
+                results[code] = pd.DataFrame()
+        return results
 
     def fetch_index_kline(self, code: str, start_date: str, end_date: str) -> pd.DataFrame:
-        rs = bs.query_history_k_data_plus(
-            code, self.INDEX_FIELDS,
-            start_date=start_date, end_date=end_date,
-            frequency="d", adjustflag="3"
-        )
-        return self._process_result(rs)
+        with _BAOSTOCK_LOCK:
+            rs = bs.query_history_k_data_plus(
+                code, self.INDEX_FIELDS,
+                start_date=start_date, end_date=end_date,
+                frequency="d", adjustflag="3"
+            )
+            return self._process_result(rs)
 
     def fetch_hs300_components(self, date: str = None) -> pd.DataFrame:
         if date is None: date = get_latest_trading_date()
-        rs = bs.query_hs300_stocks(date=date)
-        return self._process_result(rs)
-        
+        # 成分股按交易日缓存: 同一天重复跑直接读本地 Parquet，不再发网络请求
+        cache_file = CACHE_DIR / f"hs300_{date}.parquet"
+        df = self._read_cache(cache_file)
+        if df is not None:
+            return df
+        with _BAOSTOCK_LOCK:
+            rs = bs.query_hs300_stocks(date=date)
+            df = self._process_result(rs)
+        return self._write_cache(df, cache_file)
+
     def fetch_stock_industry(self, code: str) -> pd.DataFrame:
-        rs = bs.query_stock_industry(code=code)
-        return self._process_result(rs)
+        # 行业分类极少变动，按 code 缓存 (需要刷新时删 data/cache 即可)
+        safe_code = str(code).replace("/", "_")
+        cache_file = CACHE_DIR / f"industry_{safe_code}.parquet"
+        df = self._read_cache(cache_file)
+        if df is not None:
+            return df
+        with _BAOSTOCK_LOCK:
+            rs = bs.query_stock_industry(code=code)
+            df = self._process_result(rs)
+        return self._write_cache(df, cache_file)
+
+    @staticmethod
+    def _read_cache(cache_file: Path) -> Optional[pd.DataFrame]:
+        """懒加载磁盘缓存: 文件存在即命中，读失败当未命中处理"""
+        if not cache_file.exists():
+            return None
+        try:
+            return pd.read_parquet(cache_file)
+        except Exception:
+            return None
+
+    @staticmethod
+    def _write_cache(df: pd.DataFrame, cache_file: Path) -> pd.DataFrame:
+        """落盘缓存 (空表不缓存，避免把一次接口抖动固化下来)"""
+        if df is not None and not df.empty:
+            try:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                df.to_parquet(cache_file, compression='zstd')
+            except Exception:
+                pass
+        return df
 
     def _process_result(self, rs) -> pd.DataFrame:
+        """消费一个 ResultData (必须在 _BAOSTOCK_LOCK 内调用: rs.next() 的
+        分页还会在共享 socket 上继续发请求)"""
         if rs.error_code != '0': return pd.DataFrame()
-        data_list = []
+        # 按列累积: list-of-rows 构造 DataFrame 时 pandas 还要做一次行转列的
+        # 拷贝，峰值内存约 3x；直接喂 dict-of-columns 走零转置的快路径
+        columns = [[] for _ in rs.fields]
+        n_rows = 0
         while rs.next():
-            data_list.append(rs.get_row_data())
-        if not data_list: return pd.DataFrame()
-        df = pd.DataFrame(data_list, columns=rs.fields)
+            for col, val in zip(columns, rs.get_row_data()):
+                col.append(val)
+            n_rows += 1
+        if n_rows == 0: return pd.DataFrame()
+        df = pd.DataFrame(dict(zip(rs.fields, columns)), copy=False)
         return self._convert_types(df)
 
     def fetch_profit_data_history(self, code: str, start_year: int = 2010, end_year: int = None) -> pd.DataFrame:
@@ -128,20 +203,20 @@ class BaostockFetcher:
         if end_year is None:
             end_year = datetime.datetime.now().year
 
+        # (年份, 季度) 逐个串行抓取: Baostock 请求必须互斥 (见 _BAOSTOCK_LOCK)，
+        # 线程池在这里只会排队等锁，徒增调度开销
         data_list = []
-        
-        # 遍历年份和季度
-        # 注意: 这里的循环会导致网络请求较多，update模式下建议缩短年份范围
         for year in range(start_year, end_year + 1):
-            for quarter in [1, 2, 3, 4]:
-                try:
-                    rs = bs.query_profit_data(code=code, year=year, quarter=quarter)
-                    if rs.error_code == '0':
-                        while rs.next():
-                            data_list.append(rs.get_row_data())
-                except Exception:
-                    continue
-        
+            for quarter in (1, 2, 3, 4):
+                with _BAOSTOCK_LOCK:
+                    try:
+                        rs = bs.query_profit_data(code=code, year=year, quarter=quarter)
+                        if rs.error_code == '0':
+                            while rs.next():
+                                data_list.append(rs.get_row_data())
+                    except Exception:
+                        pass
+
         if not data_list:
             return pd.DataFrame()
 
@@ -164,22 +239,43 @@ class BaostockFetcher:
 
     def _convert_types(self, df: pd.DataFrame) -> pd.DataFrame:
         """重写或扩展类型转换，增加对新字段的处理"""
-        # 定义浮点列
-        float_cols = [
-            'open', 'high', 'low', 'close', 'preclose', 'volume', 'amount', 
+        # 降精度的列: 价格/比率类 float32 精度足够 (7 位有效数字)，内存减半
+        float32_cols = [
+            'open', 'high', 'low', 'close', 'preclose',
             'turn', 'pctChg', 'peTTM', 'pbMRQ', 'psTTM', 'pcfNcfTTM',
-            # 新增的财务字段
-            'roeAvg', 'npMargin', 'gpMargin', 'netProfit', 'epsTTM', 
-            'MBRevenue', 'totalShare', 'liqaShare'
+            'roeAvg', 'npMargin', 'gpMargin', 'epsTTM'
         ]
-        
-        for col in df.columns:
-            if col in float_cols:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-                
+        # 保持 64 位的列: 成交量/金额/股本等大数值 float32 放不下整数精度，
+        # 且 downcast 按各股数量级挑类型会让同一数据集的文件物理类型不一致，
+        # DuckDB 不开 union_by_name 的 glob 扫描直接报 cast 错误
+        float64_cols = ['volume', 'amount', 'netProfit', 'MBRevenue', 'totalShare', 'liqaShare']
+
+        # 一次 apply 批量转换存在的列，再按列表做固定的 astype:
+        # to_numeric 本身也看数据出类型 (纯整数串出 int64，带空值出 float64)，
+        # 两边都钉死后 dtype 与该股的取值完全无关
+        cols = [c for c in df.columns if c in float32_cols or c in float64_cols]
+        if cols:
+            df[cols] = df[cols].apply(pd.to_numeric, errors='coerce')
+        shrink = [c for c in cols if c in float32_cols]
+        if shrink:
+            df[shrink] = df[shrink].astype('float32')
+        keep64 = [c for c in cols if c in float64_cols]
+        if keep64:
+            df[keep64] = df[keep64].astype('float64')
+
         if 'isST' in df.columns:
-             df['isST'] = pd.to_numeric(df['isST'], errors='coerce').fillna(0).astype(int)
-             
+             # 0/1 标志位，uint8 足矣
+             df['isST'] = pd.to_numeric(df['isST'], errors='coerce').fillna(0).astype('uint8')
+
+        # 字符串列换成 Arrow 后端: object dtype 每行一个 PyObject (~50B 开销)，
+        # Arrow buffer 连续存放，内存省数倍，且落 Parquet 时零转换
+        for col in ('code', 'adjustflag', 'tradestatus'):
+            if col in df.columns:
+                try:
+                    df[col] = df[col].astype('string[pyarrow]')
+                except (ImportError, TypeError):
+                    break  # 环境没有 pyarrow 支持时保持 object dtype
+
         return df
 
 if __name__ == "__main__":
@@ -7,6 +7,7 @@ Mootdx 数据抽取接口
 
 import pandas as pd
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from mootdx.quotes import Quotes
 from mootdx.contrib.adjust import get_adjust_year
 from typing import List, Tuple, Dict, Any
@@ -19,8 +20,26 @@ if project_root not in sys.path:
     sys.path.append(project_root)
 
 
+# 最优行情服务器只测一次: get_adjust_year 每次调用都自建连接，
+# 选到低延迟服务器并写入 mootdx 配置后，后续所有连接都直连该服务器，
+# 省掉每个进程反复探测/回落慢节点的冷启动开销
+_BESTIP_SELECTED = False
+
+def _select_bestip_once():
+    global _BESTIP_SELECTED
+    if _BESTIP_SELECTED:
+        return
+    _BESTIP_SELECTED = True
+    try:
+        from mootdx.server import bestip
+        bestip(verbose=False)
+    except Exception:
+        # 测速失败/版本没有该接口时沿用默认服务器列表，不影响功能
+        pass
+
 class MootdxFetcher:
     def __init__(self):
+        _select_bestip_once()
         try:
             # 修改点 1: 关闭心跳 (heartbeat=False)
             # 这里的 client 主要用于测试连通性，或者未来扩展功能
@@ -57,31 +76,44 @@ class MootdxFetcher:
         if self._client is None:
             return pd.DataFrame()
 
-        start_year_int = datetime.datetime.strptime(start_date, '%Y-%m-%d').year
-        end_year_int = datetime.datetime.strptime(end_date, '%Y-%m-%d').year
-
-        all_dfs = []
+        # fromisoformat 是 C 实现的快路径，且只在入口解析一次、全程复用
+        start_date_obj = datetime.date.fromisoformat(start_date)
+        end_date_obj = datetime.date.fromisoformat(end_date)
+        start_year_int = start_date_obj.year
+        end_year_int = end_date_obj.year
 
-        # 遍历年份
-        for year_int in range(start_year_int, end_year_int + 1):
-            if year_int < ipo_year:
-                continue
+        years = [y for y in range(start_year_int, end_year_int + 1) if y >= ipo_year]
 
-            year_str = str(year_int)
+        def fetch_year(year_int):
             try:
                 # 获取复权数据
-                # 注意：mootdx 这里通常返回以日期为 Index 的 DataFrame
-                df_year = get_adjust_year(symbol=code, year=year_str, factor=adjust_factor)
-                
-                if df_year is not None and not df_year.empty:
-                    all_dfs.append(df_year)
+                # 注意：mootdx 这里通常返回以日期为 Index 的 DataFrame；
+                # get_adjust_year 内部自建连接，线程间没有共享状态
+                df_year = get_adjust_year(symbol=code, year=str(year_int), factor=adjust_factor)
+                if df_year is None or df_year.empty:
+                    return None
+                # 首尾年份先按日期索引裁掉范围外的行，中间年份天然全在范围内；
+                # 这样 concat 之后不用再复制整表做过滤
+                if year_int in (start_year_int, end_year_int):
+                    try:
+                        df_year = df_year.loc[start_date:end_date]
+                    except (KeyError, TypeError):
+                        pass  # 索引不可切片时保留整年，靠下游的兜底过滤
+                return df_year
             except Exception:
-                pass 
+                return None
+
+        # 按年并行抓取 (网络密集)，ex.map 保持年份顺序
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            results = list(ex.map(fetch_year, years))
+
+        all_dfs = [df for df in results if df is not None and not df.empty]
 
         if not all_dfs:
             return pd.DataFrame()
 
-        # 合并
+        # 合并 (pandas 3 的写时拷贝下 concat 本来就不做深拷贝；
+        # 不能用 ignore_index=True —— 日期在 Index 上，丢了就找不回 date 列)
         full_df = pd.concat(all_dfs)
 
         # 🛠️ 关键修复：重置索引，将日期从 Index 变为 Column
@@ -101,21 +133,19 @@ class MootdxFetcher:
         if 'date' not in full_df.columns:
             return pd.DataFrame()
 
-        # 类型转换与排序
-        full_df['date'] = pd.to_datetime(full_df['date']).dt.date
+        # 类型转换与排序 (cache=True: 同一批数据里大量重复日期值只解析一次)
+        full_df['date'] = pd.to_datetime(full_df['date'], cache=True).dt.date
         full_df = full_df.sort_values(by='date').reset_index(drop=True)
         
         # 添加复权因子标识列
         full_df['adjust'] = adjust_factor 
 
-        # 时间范围过滤
-        start_date_obj = datetime.datetime.strptime(start_date, '%Y-%m-%d').date()
-        end_date_obj = datetime.datetime.strptime(end_date, '%Y-%m-%d').date()
-        
+        # 时间范围兜底过滤 (主体裁剪已在 fetch_year 里做完，这里只处理
+        # 索引不可切片的回退路径)；布尔筛选本身就返回新对象，不再额外 .copy()
         full_df_filtered = full_df[
             (full_df['date'] >= start_date_obj) &
             (full_df['date'] <= end_date_obj)
-        ].copy()
+        ]
 
         # 输出列过滤
         output_cols = ['date', 'open', 'high', 'low', 'close', 'volume', 'amount', 'adjust']
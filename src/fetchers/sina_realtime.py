@@ -6,13 +6,22 @@
 """
 
 import requests
+import numpy as np
 import pandas as pd
 import datetime
 import logging
+import re
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from typing import List
 from pathlib import Path
 
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    Retry = None
+
 # 🚑 路径补丁 (方便单独运行测试)
 project_root = str(Path(__file__).resolve().parents[2])
 if project_root not in sys.path:
@@ -22,12 +31,29 @@ if project_root not in sys.path:
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 一次 C 级扫描提取 (交易所代码, CSV 载荷)，替代逐行 find/切片
+_LINE_RE = re.compile(r'hq_str_([a-z]{2}\d+)="([^"]*)"')
+
 class SinaRealtimeFetcher:
-    def __init__(self, timeout: int = 3):
+    # 快照列顺序 (解析产出的元组严格按此排列)
+    SNAPSHOT_COLS = (
+        'code', 'name', 'open', 'prev_close', 'close', 'high', 'low',
+        'buy1', 'sell1', 'vol', 'amount', 'date', 'time'
+    )
+
+    def __init__(self, timeout: int = 3, max_workers: int = 8):
         self.base_url = "http://hq.sinajs.cn/list="
         self.headers = {'Referer': 'http://finance.sina.com.cn'}
         self.timeout = timeout
         self.max_chunk_size = 80  # URL长度有限制，分批请求
+        self.max_workers = max_workers
+        # 连接池会话: 几十个分片复用同一批 keep-alive 连接，省掉每片的 TCP 握手；
+        # 网关类错误 (502/503/504) 自动小退避重试，单片抖动不必重跑整批
+        retries = (Retry(total=2, backoff_factor=0.1, status_forcelist=[502, 503, 504])
+                   if Retry else 2)
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(
+            pool_connections=16, pool_maxsize=32, max_retries=retries))
 
     def _add_exchange_prefix(self, code: str) -> str:
         """
@@ -52,96 +78,161 @@ class SinaRealtimeFetcher:
         :param code_list: 股票代码列表，如 ['600519', '000001']
         :return: DataFrame
         """
-        if not code_list:
+        merged = self._fetch_snapshot_columns(code_list)
+        if merged is None:
             return pd.DataFrame()
 
-        # 1. 代码预处理
-        sina_codes = [self._add_exchange_prefix(c) for c in code_list]
+        df = pd.DataFrame(merged, copy=False)
+
+        # 类型转换
+        df['date'] = pd.to_datetime(df['date'], errors='coerce')
+
+        # 确保列顺序符合规范
+        cols = ['code', 'name', 'date', 'time', 'open', 'high', 'low', 'close', 'prev_close', 'vol', 'amount', 'buy1', 'sell1']
+        final_cols = [c for c in cols if c in df.columns]
+
+        return df[final_cols]
+
+    def fetch_snapshot_arrow(self, code_list: List[str]):
+        """
+        Arrow 版快照: 直接返回 pyarrow.Table，跳过 pandas BlockManager。
+        下游要喂 DuckDB (con.register 零拷贝) 或直接落 Parquet 时用这个入口。
+        :return: pyarrow.Table 或 None (无有效数据)
+        """
+        import pyarrow as pa
+
+        merged = self._fetch_snapshot_columns(code_list)
+        if merged is None:
+            return None
+        # float 列从 numpy 零拷贝进 Arrow；字符串列仅此一次转换
+        return pa.table({col: pa.array(arr) for col, arr in merged.items()})
+
+    def _fetch_snapshot_columns(self, code_list: List[str]):
+        """并行抓取 + 解析，返回 dict[列名 -> np.ndarray] (无数据时 None)"""
+        if not code_list:
+            return None
+
+        # 1. 代码预处理 (向量化: 全市场 5000+ 代码逐个调 Python 函数可测量地慢)
+        s = pd.Series(code_list, dtype='string').str.strip()
+        has_prefix = s.str.startswith(('sh', 'sz', 'bj'))
+        # 首字符分类: 6->sh, 8/4->bj, 其余->sz (与 _add_exchange_prefix 一致)
+        prefix = s.str[0].map({'6': 'sh', '8': 'bj', '4': 'bj'}).fillna('sz')
+        sina_codes = prefix.mask(has_prefix, '').str.cat(s).tolist()
         total_count = len(sina_codes)
         
         logger.info(f"正在请求 {total_count} 只股票实时行情...")
         
         all_data = []
-        
-        # 2. 分批请求 (Chunking)
-        for i in range(0, total_count, self.max_chunk_size):
-            chunk = sina_codes[i : i + self.max_chunk_size]
-            query_url = self.base_url + ",".join(chunk)
-            
+
+        # 2. 分批并行请求 (Chunking):
+        # 全市场 5000+ 只要发几十个分片，串行等待 = 所有 RTT 之和；
+        # 线程池 + keep-alive 会话把总耗时压到约等于最慢一片的 RTT
+        urls = [
+            self.base_url + ",".join(sina_codes[i : i + self.max_chunk_size])
+            for i in range(0, total_count, self.max_chunk_size)
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {
+                pool.submit(self._session.get, url, headers=self.headers, timeout=self.timeout): i
+                for i, url in enumerate(urls)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    resp = future.result()
+                    parsed = self._parse_chunk(resp.content)
+                    if parsed is not None:
+                        all_data.append(parsed)
+                except Exception as e:
+                    logger.error(f"⚠️ 请求分片 {i} 失败: {e}")
+                    continue
+
+        # 3. 按列合并 (SoA 方式)
+        # 每个分片解析成 dict-of-arrays，按列 np.concatenate，
+        # 全程不经过 list-of-dicts 的逐行键哈希/转置路径
+        if not all_data:
+            return None
+
+        return {
+            col: np.concatenate([part[col] for part in all_data])
+            for col in self.SNAPSHOT_COLS
+        }
+
+    def _parse_chunk(self, raw: bytes):
+        """
+        解析单个分片的响应体 (新浪接口必须使用 GBK 解码)
+        向量化路径: 正则一次提取所有 (代码, 载荷)，9 个数值字段拼成字符串矩阵后
+        由 numpy 在 C 里一次性转 float —— 原先每行 11 次 Python float() 是解析热点。
+        :return: dict[列名 -> np.ndarray] 或 None (分片无有效数据)
+        """
+        content = raw.decode('gbk', errors='ignore')
+
+        codes, rows = [], []
+        for full_code, payload in _LINE_RE.findall(content):
+            fields = payload.split(',')
+            # 校验字段长度 (标准长度通常为 32 或 33)
+            if len(fields) >= 32:
+                codes.append(full_code[2:])  # 去掉 sh/sz/bj，保留纯数字代码
+                rows.append(fields)
+
+        if not rows:
+            return None
+
+        try:
+            # fields[1]: open, [2]: prev_close, [3]: close, [4]: high, [5]: low,
+            # [6]: buy1, [7]: sell1, [8]: vol(股), [9]: amount(元)
+            num = np.array([r[1:10] for r in rows], dtype='U32').astype(np.float64)
+        except ValueError:
+            # 分片里混有非数值脏数据时回退到逐行解析
+            return self._parse_chunk_slow(codes, rows)
+
+        # 过滤: 停牌或未开盘的无效数据 (根据原脚本逻辑，开盘价<=0 则跳过)
+        mask = num[:, 0] > 0
+        if not mask.any():
+            return None
+
+        num = num[mask]
+        return {
+            'code': np.asarray(codes, dtype=object)[mask],
+            'name': np.asarray([r[0] for r in rows], dtype=object)[mask],
+            'open': num[:, 0],
+            'prev_close': num[:, 1],
+            'close': num[:, 2],
+            'high': num[:, 3],
+            'low': num[:, 4],
+            'buy1': num[:, 5],
+            'sell1': num[:, 6],
+            'vol': num[:, 7],
+            'amount': num[:, 8],
+            'date': np.asarray([r[30] for r in rows], dtype=object)[mask],  # YYYY-MM-DD
+            'time': np.asarray([r[31] for r in rows], dtype=object)[mask],  # HH:MM:SS
+        }
+
+    def _parse_chunk_slow(self, codes, rows):
+        """逐行兜底解析 (单个坏值只丢该行，不拖垮整个分片)"""
+        columns = {col: [] for col in self.SNAPSHOT_COLS}
+        for code, fields in zip(codes, rows):
             try:
-                resp = requests.get(query_url, headers=self.headers, timeout=self.timeout)
-                # 新浪接口必须使用 GBK 解码
-                content = resp.content.decode('gbk', errors='ignore').strip()
-                lines = content.split('\n')
-                
-                for line in lines:
-                    if '=""' in line or not line: 
-                        continue 
-                    
-                    # 解析格式: var hq_str_sh600519="贵州茅台,..."
-                    eq_idx = line.find('=')
-                    if eq_idx == -1: 
-                        continue
-                    
-                    # 提取代码: var hq_str_sh600519 -> sh600519
-                    # line[0:eq_idx] 是 var hq_str_sh600519
-                    # 我们可以安全地取 eq_idx 之前的部分，并去掉 "var hq_str_" (长度11)
-                    # 剩下的就是 sh600519
-                    full_code_str = line[11:eq_idx] 
-                    stock_code = full_code_str[2:]  # 去掉 sh/sz/bj，保留纯数字代码 600519
-                    
-                    # 提取数据内容
-                    data_str = line[eq_idx+2 : -2] # 去掉 =" 和 ";
-                    fields = data_str.split(',')
-                    
-                    # 校验字段长度 (标准长度通常为 32 或 33)
-                    if len(fields) < 30: 
-                        continue 
-
-                    # 3. 字段解析
-                    # fields[1]: open, [2]: prev_close, [3]: close, [4]: high, [5]: low
-                    open_price = float(fields[1])
-                    current_price = float(fields[3])
-                    
-                    # 过滤: 停牌或未开盘的无效数据 (根据原脚本逻辑，开盘价<=0 则跳过)
-                    if open_price <= 0: 
-                        continue 
-
-                    stock_info = {
-                        'code': stock_code,
-                        'name': fields[0],
-                        'open': open_price,
-                        'prev_close': float(fields[2]),
-                        'close': current_price,
-                        'high': float(fields[4]),
-                        'low': float(fields[5]),
-                        'buy1': float(fields[6]),
-                        'sell1': float(fields[7]),
-                        'vol': float(fields[8]),    # 成交量 (股)
-                        'amount': float(fields[9]), # 成交额 (元)
-                        'date': fields[30],         # API 返回的日期 (YYYY-MM-DD)
-                        'time': fields[31]          # API 返回的时间 (HH:MM:SS)
-                    }
-                    all_data.append(stock_info)
-                    
-            except Exception as e:
-                logger.error(f"⚠️ 请求分片 {i} 失败: {e}")
+                open_price = float(fields[1])
+                if open_price <= 0:
+                    continue
+                values = (
+                    code, fields[0], open_price,
+                    float(fields[2]), float(fields[3]), float(fields[4]),
+                    float(fields[5]), float(fields[6]), float(fields[7]),
+                    float(fields[8]), float(fields[9]),
+                    fields[30], fields[31],
+                )
+            except ValueError:
                 continue
-    
-        # 4. 构建 DataFrame
-        if not all_data:
-            return pd.DataFrame()
-            
-        df = pd.DataFrame(all_data)
-        
-        # 类型转换
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        
-        # 确保列顺序符合规范
-        cols = ['code', 'name', 'date', 'time', 'open', 'high', 'low', 'close', 'prev_close', 'vol', 'amount', 'buy1', 'sell1']
-        final_cols = [c for c in cols if c in df.columns]
-        
-        return df[final_cols]
+            for col, val in zip(self.SNAPSHOT_COLS, values):
+                columns[col].append(val)
+
+        if not columns['code']:
+            return None
+        return {col: np.asarray(vals, dtype=None if col not in
+                                ('code', 'name', 'date', 'time') else object)
+                for col, vals in columns.items()}
 
 # ==========================================
 # 测试代码
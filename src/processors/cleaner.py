@@ -7,7 +7,7 @@
 """
 
 import pandas as pd
-import numpy as np
+import re
 import sys
 from pathlib import Path
 
@@ -17,15 +17,54 @@ if project_root not in sys.path:
     sys.path.append(project_root)
 
 class DataCleaner:
-    
+
+    # 同花顺中文报告期 -> 报告期末 (月, 日)；配合预编译正则做整列解析
+    _PERIOD_RE = re.compile(r'^(\d{4}).*?(年报|中报|一季|三季)')
+    _PERIOD_MONTH = {'年报': 12, '中报': 6, '一季': 3, '三季': 9}
+    _PERIOD_DAY = {'年报': 31, '中报': 30, '一季': 31, '三季': 30}
+
+    # 列名映射表提到类级: 每次调用不再重建 dict，配合 columns 原地替换
+    # 省掉 rename 内部整帧拷贝
+    _BS_PROFIT_MAP = {
+        'statDate': 'report_date',      # 对齐 Akshare
+        'pubDate': 'publish_date',
+        'totalShare': 'total_share',
+        'liqaShare': 'circulating_share'  # 流通股
+    }
+    _DIVIDEND_MAP = {
+        "报告期": "report_period_str",  # 保留原始列备查
+        "税前分红率": "dividend_yield",
+        "股利支付率": "dividend_payout_ratio",
+        "A股除权除息日": "ex_dividend_date",
+        "分红总额": "total_dividend"
+    }
+
+
     @staticmethod
-    def normalize_date(df: pd.DataFrame, date_col: str = 'date') -> pd.DataFrame:
-        """统一日期格式为 datetime.date (YYYY-MM-DD)"""
+    def normalize_date(df: pd.DataFrame, date_col: str = 'date',
+                       fmt: str = '%Y-%m-%d') -> pd.DataFrame:
+        """统一日期格式为 datetime.date (fmt 为该列已知的字符串格式)"""
         if df.empty or date_col not in df.columns:
             return df
         try:
-            df[date_col] = pd.to_datetime(df[date_col], errors='coerce').dt.date
-            df = df.dropna(subset=[date_col])
+            series = df[date_col]
+            parsed = None
+            # pandas 3 起字符串列默认是 str dtype 而非 object，两种都要放行，
+            # 否则快速路径永远不命中
+            if pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+                # 快速路径: 各数据源的日期格式固定 (Baostock 'YYYY-MM-DD'、
+                # Akshare 'YYYYMMDD' 等)，指定 format 跳过逐值格式推断
+                # (全量清洗时有千万级解析量，差一个数量级)
+                try:
+                    parsed = pd.to_datetime(series, format=fmt, cache=True)
+                except (ValueError, TypeError):
+                    parsed = None
+            if parsed is None:
+                # 慢速兜底: 混合格式/非字符串列走原来的推断逻辑
+                parsed = pd.to_datetime(series, errors='coerce', cache=True)
+            df[date_col] = parsed.dt.date
+            # inplace: 不再为 dropna 分配一个完整的新帧
+            df.dropna(subset=[date_col], inplace=True)
         except Exception:
             pass
         return df
@@ -39,13 +78,35 @@ class DataCleaner:
         df = DataCleaner.normalize_date(df, 'date')
         
         numeric_cols = ['open', 'high', 'low', 'close', 'volume', 'amount', 'turn', 'pctchg', 'pettm']
-        for col in numeric_cols:
-            if col in df.columns:
+        for col in df.columns.intersection(numeric_cols):
+            # Fetcher 层已经转好的数值列直接跳过，不做冗余的二次 cast
+            if not pd.api.types.is_numeric_dtype(df[col]):
                 df[col] = pd.to_numeric(df[col], errors='coerce')
         
         if 'isst' in df.columns:
              df['isst'] = pd.to_numeric(df['isst'], errors='coerce').fillna(0).astype(int)
 
+        # 降精度: 行情/估值列 float32 精度足够，内存和落盘字节数直接减半；
+        # code 是低基数字符串，转 category 后 Parquet 走字典编码
+        float32_cols = [
+            'open', 'high', 'low', 'close', 'preclose', 'turn', 'pctchg',
+            'pettm', 'pbmrq', 'psttm', 'pcfncfttm'
+        ]
+        for col in float32_cols:
+            if col in df.columns and pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = df[col].astype('float32')
+
+        if 'code' in df.columns:
+            df['code'] = df['code'].astype('category')
+
+        # volume/amount 固定 float64: downcast 按该股的数量级/缺失情况挑
+        # int32/int64/float64，同一数据集各文件物理类型不一致，DuckDB 不开
+        # union_by_name 的 glob 扫描会报 cast 错误。统一 64 位浮点既容纳
+        # 停牌日的 NaN，也和 Fetcher 层钉死的 dtype 一致
+        for col in ('volume', 'amount'):
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+
         return df
 
     @staticmethod
@@ -74,30 +135,30 @@ class DataCleaner:
         # 我们需要保留 '指标' 列，扔掉 '选项' 列(因为它对区分指标没用，指标名本身通常唯一)
         # 如果指标名有重复（比如 '每股收益' 出现了两次），我们需要去重或合并
         
-        if '选项' in df.columns:
-            # 也可以保留选项作为前缀，比如 "常用指标_净利润"，防止重名
-            # 这里简单起见，我们优先使用 '指标' 列。
-            # 检查是否有重名指标，如果有，可以用 选项+指标 组合
-            df['unique_key'] = df['指标'] 
-            # 简单的去重策略：如果 duplicate，保留第一个
-            df = df.drop_duplicates(subset=['unique_key'])
-            df = df.drop(columns=['选项', '指标'])
-            df = df.set_index('unique_key')
-        else:
+        if '选项' not in df.columns:
             # 防御性编程
             return pd.DataFrame()
 
-        # 3. 转置: 现在行是指标，列是日期 -> 转置后 行是日期，列是指标
-        # 此时 df.columns 应该是 ['20250930', '20250630', ...]
-        df_T = df.T 
-        
-        # 4. 整理索引 (变成 report_date 列)
-        df_T.index.name = 'report_date'
-        df_T = df_T.reset_index()
+        # 也可以保留选项作为前缀，比如 "常用指标_净利润"，防止重名
+        # 这里简单起见，我们优先使用 '指标' 列。
+        # 简单的去重策略：如果 duplicate，保留第一个
+        df = df.drop_duplicates(subset=['指标'])
+
+        # 3/4. 转置: 行是指标、列是日期 -> 行是日期、列是指标
+        # 不走 DataFrame.T: 它在 object 混合数据上要整帧装箱再重建 block，
+        # 是 pandas 最慢的操作之一；to_numpy().T 只翻转 strides，零拷贝
+        indicators = df['指标'].tolist()
+        date_cols = [c for c in df.columns if c not in ('选项', '指标')]
+        df_T = pd.DataFrame(df[date_cols].to_numpy().T, columns=indicators, copy=False)
+        df_T.insert(0, 'report_date', date_cols)
         
         # 5. 清洗日期
-        # 列名里的日期可能是 '20250930' 字符串
-        df_T['report_date'] = pd.to_datetime(df_T['report_date'], errors='coerce')
+        # 列名里的日期就是 '20250930' 这类字符串，固定 format 走快路径；
+        # cache=True 对重复的报告期标签只解析一次
+        try:
+            df_T['report_date'] = pd.to_datetime(df_T['report_date'], format='%Y%m%d', cache=True)
+        except (ValueError, TypeError):
+            df_T['report_date'] = pd.to_datetime(df_T['report_date'], errors='coerce')
         # 删掉日期转换失败的行 (可能是脏数据列)
         df_T = df_T.dropna(subset=['report_date'])
         df_T['report_date'] = df_T['report_date'].dt.date
@@ -106,10 +167,21 @@ class DataCleaner:
         if stock_code:
             df_T['code'] = stock_code
 
+        exclude = ['report_date', 'code']
+
+        # 6.5 过渡列换 Arrow 后端: 转置出来的指标列全是 object 字符串，
+        # 每值背着 ~49B 的 PyObject 开销；string[pyarrow] 用连续 buffer 存放，
+        # 批量清洗几千只股票时瞬时内存低好几倍
+        for col in df_T.columns:
+            if col not in exclude and df_T[col].dtype == object:
+                try:
+                    df_T[col] = df_T[col].astype('string[pyarrow]')
+                except (ImportError, TypeError):
+                    break  # 环境不支持时保持 object dtype
+
         # 7. 自动清洗所有数值列
         # 现在的列名就是之前的指标名 (净利润, ROE...)
         # 遍历除了 date/code 以外的所有列，尝试转 numeric
-        exclude = ['report_date', 'code']
         for col in df_T.columns:
             if col not in exclude:
                 # 统一转 numeric，无法转换的变 NaN
@@ -126,16 +198,8 @@ class DataCleaner:
         """清洗 Baostock 盈利能力数据"""
         if df.empty: return df
         
-        # 1. 重命名列以匹配系统标准
-        # statDate -> report_date (对齐 Akshare)
-        # pubDate -> publish_date
-        rename_map = {
-            'statDate': 'report_date',
-            'pubDate': 'publish_date',
-            'totalShare': 'total_share',
-            'liqaShare': 'circulating_share' # 流通股
-        }
-        df = df.rename(columns=rename_map)
+        # 1. 重命名列以匹配系统标准 (原地替换 Index，不走 rename 的拷贝路径)
+        df.columns = [DataCleaner._BS_PROFIT_MAP.get(c, c) for c in df.columns]
         
         # 2. 清洗日期
         df = DataCleaner.normalize_date(df, 'report_date')
@@ -167,14 +231,14 @@ class DataCleaner:
 
         # Merge
         # 使用 left join，以 Akshare 为主（因为 Akshare 包含所有历史，而 Baostock 可能只抓了近几年的）
-        # on=['code', 'report_date']
+        # join 走索引路径: 右表建一次 MultiIndex 后按索引探查，
+        # 比 pd.merge 每次对两边做哈希 + 末尾排序省一截
         try:
-            merged_df = pd.merge(
-                df_ak, 
-                df_bs, 
-                on=['code', 'report_date'], 
-                how='left', 
-                suffixes=('', '_bs') # 如果有重名列，Baostock的加后缀
+            merged_df = df_ak.join(
+                df_bs.set_index(['code', 'report_date']),
+                on=['code', 'report_date'],
+                how='left',
+                rsuffix='_bs'  # 如果有重名列，Baostock的加后缀
             )
             return merged_df
         except Exception as e:
@@ -202,7 +266,7 @@ class DataCleaner:
         # 提取年份 (前4位)
         try:
             year = int(text[:4])
-        except:
+        except ValueError:
             return pd.NaT
             
         if "年报" in text:
@@ -216,6 +280,28 @@ class DataCleaner:
         else:
             return pd.NaT
 
+    # 一遍正则同时拿到 (数值, 后缀)，替代多次 replace/contains 的重复扫描
+    _NUM_SUFFIX_RE = re.compile(r'^(-?\d+(?:\.\d+)?)([%亿万])?$')
+
+    @staticmethod
+    def _clean_pct_series(series: pd.Series) -> pd.Series:
+        """整列版: '1.52%' -> 0.0152, '--'/无百分号 -> NaN"""
+        ext = series.astype('string').str.strip().str.extract(DataCleaner._NUM_SUFFIX_RE)
+        vals = pd.to_numeric(ext[0], errors='coerce') / 100.0
+        # '--' 等不匹配的格子提取出 pd.NA，比较结果也是 NA，必须先填成 False
+        # 才能当掩码用 (where 对含 NA 的布尔掩码直接抛错)
+        return vals.where((ext[1] == '%').fillna(False)).astype(float)
+
+    @staticmethod
+    def _clean_amount_series(series: pd.Series) -> pd.Series:
+        """整列版: '2.94亿' -> 2.94e8, '500万' -> 5e6, 其余 ('--'/纯数字) -> NaN"""
+        ext = series.astype('string').str.strip().str.extract(DataCleaner._NUM_SUFFIX_RE)
+        base = pd.to_numeric(ext[0], errors='coerce')
+        # map 对 NA 安全: 无后缀/'--' 的格子映射成 NaN；
+        # np.select 会在 NA 上炸 (pd.NA == '亿' 得 NA，无法转 bool)
+        scale = ext[1].map({'亿': 1e8, '万': 1e4}).astype(float)
+        return (base * scale).astype(float)
+
     @staticmethod
     def clean_dividend_data(df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -223,63 +309,62 @@ class DataCleaner:
         """
         if df.empty: return df
         
-        # 1. 映射字段名
-        # 报告期 -> report_date (用于对齐)
-        # 税前分红率 -> dividend_yield
-        # 股利支付率 -> dividend_payout_ratio
-        # A股除权除息日 -> ex_dividend_date
-        rename_map = {
-            "报告期": "report_period_str", # 保留原始列备查
-            "税前分红率": "dividend_yield",
-            "股利支付率": "dividend_payout_ratio",
-            "A股除权除息日": "ex_dividend_date",
-            "分红总额": "total_dividend"
-        }
-        df = df.rename(columns=rename_map)
+        # 1. 映射字段名 (映射表见类顶部 _DIVIDEND_MAP；原地替换 Index)
+        df.columns = [DataCleaner._DIVIDEND_MAP.get(c, c) for c in df.columns]
         
         # 2. 处理报告期 (转为标准 date)
+        # 整列一次正则提取 (年份, 期别)，再 map 成月/日向量拼日期；
+        # 比逐格 apply 四次子串扫描 + 单独构造 Timestamp 快一个数量级
         if "report_period_str" in df.columns:
-            df['report_date'] = df['report_period_str'].apply(DataCleaner._parse_ths_report_period)
+            ext = df['report_period_str'].astype('string').str.extract(DataCleaner._PERIOD_RE)
+            # 各列强转普通 float64 (NaN 而非 pd.NA): to_datetime 按列拼日期时
+            # 无法处理含 NA 的可空整型，即使 errors='coerce' 也会抛
+            # \"cannot convert NA to integer\"；float64+NaN 则正常得到 NaT
+            parts = pd.DataFrame({
+                'year': pd.to_numeric(ext[0], errors='coerce').astype('float64'),
+                'month': ext[1].map(DataCleaner._PERIOD_MONTH).astype('float64'),
+                'day': ext[1].map(DataCleaner._PERIOD_DAY).astype('float64'),
+            })
+            df['report_date'] = pd.to_datetime(parts, errors='coerce').dt.date
             # 过滤解析失败的行
             df = df.dropna(subset=['report_date'])
         
-        # 3. 处理百分比和单位
-        def clean_pct(val):
-            """ 1.52% -> 0.0152, -- -> NaN """
-            if pd.isna(val): return np.nan
-            s = str(val).strip()
-            if '%' in s:
-                try:
-                    return float(s.replace('%', '')) / 100.0
-                except: return np.nan
-            return np.nan
-
-        def clean_amount(val):
-            """ 2.94亿 -> 2.94e8 """
-            if pd.isna(val): return np.nan
-            s = str(val).strip()
-            if '亿' in s:
-                try:
-                    return float(s.replace('亿', '')) * 1e8
-                except: return np.nan
-            if '万' in s:
-                try:
-                    return float(s.replace('万', '')) * 1e4
-                except: return np.nan
-            return np.nan
-
+        # 3. 处理百分比和单位 (向量化: .apply 是逐格的 Python 循环，
+        # 换成整列的 .str 操作 + 一次 to_numeric，热循环全在 C 里)
         if 'dividend_yield' in df.columns:
-            df['dividend_yield'] = df['dividend_yield'].apply(clean_pct)
-            
+            df['dividend_yield'] = DataCleaner._clean_pct_series(df['dividend_yield'])
+
         if 'dividend_payout_ratio' in df.columns:
-            df['dividend_payout_ratio'] = df['dividend_payout_ratio'].apply(clean_pct)
-            
+            df['dividend_payout_ratio'] = DataCleaner._clean_pct_series(df['dividend_payout_ratio'])
+
         if 'total_dividend' in df.columns:
-            df['total_dividend'] = df['total_dividend'].apply(clean_amount)
+            df['total_dividend'] = DataCleaner._clean_amount_series(df['total_dividend'])
             
         if 'ex_dividend_date' in df.columns:
             df['ex_dividend_date'] = pd.to_datetime(df['ex_dividend_date'], errors='coerce').dt.date
 
         # 4. 筛选保留字段
         keep_cols = ['code', 'report_date', 'dividend_yield', 'dividend_payout_ratio', 'total_dividend', 'ex_dividend_date']
-        return df[[c for c in keep_cols if c in df.columns]]
\ No newline at end of file
+        return df[[c for c in keep_cols if c in df.columns]]
+
+# --- 简单测试 ---
+if __name__ == "__main__":
+    # 同花顺真实分红表里到处是 '--' 占位符，清洗必须对它免疫
+    df_div = pd.DataFrame({
+        "报告期": ["2022年报", "2023中报", "2023三季报", "不适用", "--"],
+        "税前分红率": ["1.52%", "--", None, "2.10%", None],
+        "股利支付率": ["30.00%", "--", "45.50%", None, None],
+        "分红总额": ["2.94亿", "--", "500万", "1.00亿", None],
+        "A股除权除息日": ["2023-06-30", "--", None, None, None],
+        "code": "sh.600000",
+    })
+    out = DataCleaner.clean_dividend_data(df_div)
+    print(out)
+    # 报告期无法解析 ('不适用'/'--') 的行整行丢弃，与旧的逐格解析语义一致
+    assert len(out) == 3
+    assert out['total_dividend'].iloc[0] == 2.94e8
+    assert pd.isna(out['total_dividend'].iloc[1])
+    assert out['total_dividend'].iloc[2] == 5e6
+    assert abs(out['dividend_yield'].iloc[0] - 0.0152) < 1e-9
+    assert pd.isna(out['dividend_yield'].iloc[1])
+    print("✅ clean_dividend_data 脏数据用例通过")
\ No newline at end of file
@@ -137,5 +137,5 @@ if __name__ == "__main__":
         try:
             os.remove(os.path.join(project_root, test_db))
             print("\n测试清理完成。")
-        except:
+        except OSError:
             pass
\ No newline at end of file
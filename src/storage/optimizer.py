@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Optimized 层物化器
+路径: src/storage/optimizer.py
+功能:
+    1. 把 data/processed 下碎片化的 Hive Partition 数据合并成 data/optimized 下的单文件
+    2. 按 mtime 增量触发: 源数据没变的数据集直接跳过
+    说明: demo_usage.register_smart_view 会优先读取 optimized 层 (极速模式)，
+    分析型查询 (最新收盘价/按股聚合等) 从此只需扫单文件的 Row Group 统计信息。
+"""
+
+import duckdb
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+# 🚑 路径补丁
+project_root = str(Path(__file__).resolve().parents[2])
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from config.settings import PROCESSED_DIR, OPTIMIZED_DIR
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__, "optimizer.log")
+
+def _latest_mtime(directory: Path) -> float:
+    """目录下所有 parquet 文件的最新修改时间 (只读元数据，不读内容)"""
+    latest = 0.0
+    for f in directory.rglob("*.parquet"):
+        mtime = f.stat().st_mtime
+        if mtime > latest:
+            latest = mtime
+    return latest
+
+def build_optimized_views(categories: Optional[List[str]] = None):
+    """
+    物化 optimized 层
+    :param categories: 指定数据集列表 (如 ['stock_price_daily'])；None 表示全部
+    """
+    processed = Path(PROCESSED_DIR)
+    if not processed.exists():
+        logger.warning("⚠️ No processed data found, nothing to optimize.")
+        return
+
+    if categories is None:
+        categories = sorted(d.name for d in processed.iterdir() if d.is_dir())
+
+    for category in categories:
+        src_dir = processed / category
+        if not src_dir.exists():
+            continue
+
+        dst_dir = Path(OPTIMIZED_DIR) / category
+        dst_file = dst_dir / f"{category}.parquet"
+
+        # 增量判断: 目标比所有源文件都新则跳过
+        src_mtime = _latest_mtime(src_dir)
+        if src_mtime == 0.0:
+            continue
+        if dst_file.exists() and dst_file.stat().st_mtime >= src_mtime:
+            logger.info(f"⏩ [{category}] up-to-date, skip.")
+            continue
+
+        dst_dir.mkdir(parents=True, exist_ok=True)
+        glob_path = src_dir.as_posix() + "/**/*.parquet"
+
+        try:
+            con = duckdb.connect()
+            sql = (
+                f"COPY (SELECT * FROM read_parquet('{glob_path}', hive_partitioning=true)) "
+                f"TO '{dst_file.as_posix()}' (FORMAT PARQUET, COMPRESSION ZSTD)"
+            )
+            con.execute(sql)
+            con.close()
+            logger.info(f"🚀 [{category}] materialized -> {dst_file}")
+        except Exception as e:
+            logger.error(f"❌ Failed to materialize {category}: {e}")
+
+# --- 简单测试 ---
+if __name__ == "__main__":
+    build_optimized_views()
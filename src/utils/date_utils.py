@@ -5,8 +5,42 @@
 依赖: akshare, pandas
 """
 import akshare as ak
+import functools
+import numpy as np
 import pandas as pd
 import datetime
+import sys
+from pathlib import Path
+
+# 🚑 路径补丁
+project_root = str(Path(__file__).resolve().parents[2])
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from config.settings import CACHE_DIR
+
+_CAL_CACHE = CACHE_DIR / "trade_cal.parquet"
+
+def _load_trade_calendar() -> pd.DataFrame:
+    """
+    交易日历带磁盘缓存: 日历一天最多变一次，文件 mtime 是今天就直接读本地
+    Parquet，跨进程也不用重新下载；读写失败一律回退到在线获取。
+    """
+    if _CAL_CACHE.exists():
+        try:
+            mtime_day = datetime.date.fromtimestamp(_CAL_CACHE.stat().st_mtime)
+            if mtime_day == datetime.date.today():
+                return pd.read_parquet(_CAL_CACHE)
+        except Exception:
+            pass
+
+    df = ak.tool_trade_date_hist_sina()
+    try:
+        _CAL_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        df[['trade_date']].to_parquet(_CAL_CACHE)
+    except Exception:
+        pass
+    return df
 
 def get_latest_trading_date() -> str:
     """
@@ -14,28 +48,28 @@ def get_latest_trading_date() -> str:
     利用新浪数据源判断：
     - 如果今天是交易日，返回今天；
     - 如果今天是周末/节假日，返回最近的一个之前的交易日。
+    结果按自然日缓存: 同一天内重复调用 (股票列表/成分股各查一次) 不再重复下载日历。
     """
+    return _latest_trading_date_cached(datetime.date.today().isoformat())
+
+@functools.lru_cache(maxsize=4)
+def _latest_trading_date_cached(today_str: str) -> str:
     try:
-        # 获取交易日历 DataFrame，包含列 ['trade_date']
-        df = ak.tool_trade_date_hist_sina()
-        
-        # 确保转为 date 类型以便比较
-        df['trade_date'] = pd.to_datetime(df['trade_date']).dt.date
-        
+        # 获取交易日历 DataFrame，包含列 ['trade_date'] (优先走磁盘缓存)
+        df = _load_trade_calendar()
+
+        # 日历升序排列，二分查找最后一个 <= 今天的交易日:
+        # O(log N) 且零分配，替代整列布尔掩码 + 新帧
+        arr = pd.to_datetime(df['trade_date']).to_numpy().astype('datetime64[D]')
         today = datetime.date.today()
-        
-        # 筛选出小于等于今天的交易日
-        # tail(1) 取最后一个即为离今天最近的
-        valid_dates = df[df['trade_date'] <= today]
-        
-        if valid_dates.empty:
+        idx = np.searchsorted(arr, np.datetime64(today, 'D'), side='right') - 1
+
+        if idx < 0:
             # 极少见情况（如早于1990年），返回今天兜底
             return today.strftime('%Y-%m-%d')
-        
-        latest_date = valid_dates.iloc[-1]['trade_date']
-        
-        return latest_date.strftime('%Y-%m-%d')
-        
+
+        return str(arr[idx])  # datetime64[D] 的 str 形式就是 'YYYY-MM-DD'
+
     except Exception as e:
         print(f"⚠️ 获取交易日历失败，使用今日日期兜底: {e}")
         return datetime.date.today().strftime('%Y-%m-%d')
@@ -5,11 +5,14 @@
 功能: 提供统一的日志配置，支持控制台输出和文件滚动记录
 """
 
+import atexit
 import logging
 import os
+import queue
 import sys
+import threading
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 # 1. 自动确定日志存储路径
 # 向上寻找项目根目录 (假设当前文件在 src/utils/ 下)
@@ -25,6 +28,49 @@ if not os.path.exists(LOG_DIR):
 DEFAULT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+class FastRotatingFileHandler(RotatingFileHandler):
+    """
+    免 stat 的滚动文件 Handler:
+    标准 RotatingFileHandler 每条日志都对 baseFilename 做 exists/isfile 系统调用
+    来判断是否该滚动；逐股循环里高频打日志时这两次 syscall 占比可观。
+    改用已打开流的 tell() 估算文件大小，零系统调用。
+    """
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        if self.maxBytes <= 0:
+            return False
+        msg = self.format(record) + self.terminator
+        return self.stream.tell() + len(msg) >= self.maxBytes
+
+# 日志异步化: 业务线程只往队列塞 LogRecord，格式化和磁盘写入由后台
+# 监听线程完成，紧循环里的 logger.error 不再被文件 I/O 阻塞
+_listeners = []
+_listener_lock = threading.Lock()
+
+def _start_listener(q, *handlers):
+    listener = QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    with _listener_lock:
+        _listeners.append(listener)
+    return listener
+
+def shutdown_logging():
+    """停止所有后台日志线程并刷掉队列里剩余的记录 (进程退出时自动调用)"""
+    with _listener_lock:
+        pending, _listeners[:] = _listeners[:], []
+    for listener in pending:
+        try:
+            listener.stop()
+        except Exception:
+            pass
+
+atexit.register(shutdown_logging)
+
+# get_logger 结果缓存: 各模块 import 时都会调一次，命中后连 getLogger
+# 查找和 handler 检查都省掉
+_logger_cache = {}
+
 def get_logger(name: str = "System", log_filename: str = "app.log", level=logging.INFO):
     """
     获取配置好的 Logger 对象
@@ -34,10 +80,16 @@ def get_logger(name: str = "System", log_filename: str = "app.log", level=loggin
     :param level: 日志级别 (logging.INFO / DEBUG / ERROR)
     :return: logger 实例
     """
+    cache_key = (name, log_filename)
+    cached = _logger_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     logger = logging.getLogger(name)
-    
+
     # 防止重复添加 Handler (如果 logger 已存在且已有 handler，直接返回)
     if logger.handlers:
+        _logger_cache[cache_key] = logger
         return logger
 
     logger.setLevel(level)
@@ -49,7 +101,6 @@ def get_logger(name: str = "System", log_filename: str = "app.log", level=loggin
     console_handler.setLevel(level)
     console_formatter = logging.Formatter(DEFAULT_FORMAT, datefmt=DATE_FORMAT)
     console_handler.setFormatter(console_formatter)
-    logger.addHandler(console_handler)
 
     # ---------------------------
     # 2. 文件 Handler (RotatingFileHandler)
@@ -59,16 +110,26 @@ def get_logger(name: str = "System", log_filename: str = "app.log", level=loggin
     
     # maxBytes=10MB (10*1024*1024), backupCount=5 (保留5个历史文件)
     # encoding='utf-8' 防止中文乱码
-    file_handler = RotatingFileHandler(
-        log_path, 
-        maxBytes=10*1024*1024, 
-        backupCount=5, 
-        encoding='utf-8'
+    # delay=True: 首条日志真正 emit 时才 open() 文件，import 即建 logger 的
+    # 模块 (dry-run/短脚本) 不再在启动时就各开一个空日志文件
+    file_handler = FastRotatingFileHandler(
+        log_path,
+        maxBytes=10*1024*1024,
+        backupCount=5,
+        encoding='utf-8',
+        delay=True
     )
     file_handler.setLevel(level)
     file_handler.setFormatter(console_formatter)
-    logger.addHandler(file_handler)
 
+    # ---------------------------
+    # 3. 异步化: logger 上只挂 QueueHandler，真正的输出交给后台监听线程
+    # ---------------------------
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    _start_listener(log_queue, console_handler, file_handler)
+
+    _logger_cache[cache_key] = logger
     return logger
 
 # --- 测试代码 ---
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+限流器
+路径: src/utils/rate_limiter.py
+功能: 基于滑动窗口的令牌桶限流，替代无脑 time.sleep(N)
+    固定 sleep 的问题: 请求本身耗时多久都照睡不误，一千个概念板块平白多等几分钟；
+    令牌桶只在真的超出 "每秒 N 次" 预算时才补觉，慢请求自然消耗预算。
+"""
+
+import time
+import threading
+from collections import deque
+
+class RateLimiter:
+    def __init__(self, rps: float = 3.0):
+        """
+        :param rps: 每秒允许的请求数 (requests per second)
+        """
+        self.max_calls = max(1, int(rps))
+        self._window = 1.0
+        self._stamps = deque()
+        self._lock = threading.Lock()  # 多线程 worker 共享同一个预算
+
+    def acquire(self):
+        """阻塞直到拿到一个令牌"""
+        with self._lock:
+            now = time.monotonic()
+            while self._stamps and now - self._stamps[0] >= self._window:
+                self._stamps.popleft()
+
+            if len(self._stamps) >= self.max_calls:
+                wait = self._window - (now - self._stamps[0])
+                if wait > 0:
+                    time.sleep(wait)
+                now = time.monotonic()
+                while self._stamps and now - self._stamps[0] >= self._window:
+                    self._stamps.popleft()
+
+            self._stamps.append(time.monotonic())
+
+# --- 简单测试 ---
+if __name__ == "__main__":
+    limiter = RateLimiter(rps=5)
+    start = time.monotonic()
+    for i in range(12):
+        limiter.acquire()
+        print(f"req {i} at {time.monotonic() - start:.2f}s")
@@ -8,6 +8,7 @@
 """
 
 import baostock as bs
+import numpy as np
 import pandas as pd
 import datetime
 import sys
@@ -22,6 +23,10 @@ if project_root not in sys.path:
 
 from config.settings import DATA_DIR
 
+# 股票代码前缀 (沪市主板/深市主板/创业板/北交所)，排除指数等非股票代码；
+# startswith 传元组只做一次 C 级循环，替代逐个前缀的多次 Python 调用
+STOCK_PREFIXES = ("sh.6", "sz.0", "sz.3", "bj.")
+
 def generate_full_market_codes(save_path: str = None):
     """
     生成全历史股票列表
@@ -45,9 +50,12 @@ def generate_full_market_codes(save_path: str = None):
     df_trade['calendar_date'] = pd.to_datetime(df_trade['calendar_date'])
     
     # 2. 提取每年的最后一个交易日
-    # 按年份分组，取最大日期
-    df_trade['year'] = df_trade['calendar_date'].dt.year
-    year_end_dates = df_trade.groupby('year')['calendar_date'].max().dt.strftime('%Y-%m-%d').tolist()
+    # 排序后按年去重保留最后一行: O(N) 线性扫描，省掉 groupby 的哈希分组开销；
+    # datetime64[Y] 直接在 ns 缓冲上整除出年份，不走 .dt.year
+    df_trade = df_trade.sort_values('calendar_date')
+    df_trade['year'] = df_trade['calendar_date'].to_numpy().astype('datetime64[Y]').astype(np.int16) + 1970
+    last_per_year = df_trade.drop_duplicates('year', keep='last')
+    year_end_dates = last_per_year['calendar_date'].dt.strftime('%Y-%m-%d').tolist()
     
     # 补上今天 (确保包含最近上市的新股)
     if end_date not in year_end_dates:
@@ -56,21 +64,27 @@ def generate_full_market_codes(save_path: str = None):
     print(f"将回溯查询以下 {len(year_end_dates)} 个历史时间点的成分股:")
     print(f"{year_end_dates[0]} ... {year_end_dates[-1]}")
 
-    # 3. 循环查询并收集代码
-    all_codes = set()
-    
-    for date in tqdm(year_end_dates, desc="Sampling History"):
+    # 3. 逐个时间点查询并收集代码
+    # ⚠️ 不能并发: bs 全进程只有一条 socket 且无同步，query_all_stock 的分页
+    # (get_data 内部的 next) 并发时会互相吃掉对方的响应，静默拿错数据
+    def fetch_codes_at(date):
         try:
             rs = bs.query_all_stock(day=date)
-            while rs.next():
-                # Baostock 返回 [code, tradeStatus, code_name]
-                code = rs.get_row_data()[0]
-                # 过滤指数
-                if code.startswith("sh.6") or code.startswith("sz.0") or code.startswith("sz.3") or code.startswith("bj."):
-                    all_codes.add(code)
+            # get_data() 在 C 边界内一次拉完所有分页，返回 DataFrame
+            # (列为 [code, tradeStatus, code_name])，免去逐行 next() 的往返
+            df = rs.get_data()
+            if df.empty:
+                return set()
+            # 过滤指数: 向量化 startswith 一次扫完整列
+            mask = df['code'].str.startswith(STOCK_PREFIXES)
+            return set(df.loc[mask, 'code'])
         except Exception:
-            pass
-            
+            return set()
+
+    all_codes = set()
+    for date in tqdm(year_end_dates, desc="Sampling History"):
+        all_codes.update(fetch_codes_at(date))
+
     bs.logout()
     
     # 4. 排序与保存